@@ -1,25 +1,82 @@
-import hashlib
+import asyncio
+import multiprocessing
+import os
+import re
+import tempfile
 import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
+
+# thread policy must be set before faiss/numpy load their OpenMP/BLAS
+# runtimes: passive waiting stops spin-wait thrashing between FAISS and
+# BLAS pools, which otherwise shows up as multi-second query jitter
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
+os.environ.setdefault("OMP_NUM_THREADS", str(min(4, os.cpu_count() or 1)))
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", str(min(4, os.cpu_count() or 1)))
+
 from pydantic import BaseModel
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import config
 from rag_chatbot.indexing.document_processor import DocumentProcessor
 from rag_chatbot.stores.vector_store import VectorStore, build_vector_store
 from rag_chatbot.pipeline.rag_system import RAGEngine, DEFAULT_REFUSAL
 from rag_chatbot.llm.llm_handler import ChatLLM
 
+# shared with the Streamlit saver so both UIs produce identical dedup names
+from rag_chatbot.hashing import new_content_hasher as _new_content_hasher, hex12 as _hex12
+
+# read/hash/write uploads in chunks of this size
+_UPLOAD_CHUNK = 1 << 20
+
+# citation marker pattern, compiled once (same regex the UI uses)
+_CITE_RE = re.compile(r"\[source:\s*[^\]]+\]")
+# keep this many chars unflushed so a citation split across tokens is still caught
+_CITE_TAIL = 64
+
 # global singletons
-ENGINE_LOCK = threading.Lock()
 ENGINE: Optional[RAGEngine] = None
 VSTORE: Optional[VectorStore] = None
 
+# rebuild coordination: asyncio lock keeps the event loop responsive while a
+# single-worker process pool isolates the CPU-heavy build from query traffic.
+# spawn, not fork: the worker starts on the first /rebuild, by which time this
+# process holds live ONNX Runtime sessions (model cache) and FAISS/OpenMP
+# thread state that do not survive a fork
+_REBUILD_LOCK = asyncio.Lock()
+_REBUILD_POOL = ProcessPoolExecutor(max_workers=1,
+                                    mp_context=multiprocessing.get_context("spawn"))
+
+def _rebuild_worker(data_dir: str) -> int:
+    """Runs in the worker process: parse documents and write the index to disk.
+    Returns the vector count, 0 for no documents, -1 on build failure"""
+    processor = DocumentProcessor()
+    docs = processor.process_directory(data_dir)
+    if not docs:
+        return 0
+    vs = build_vector_store(docs, force_rebuild=True)
+    if not vs or not vs.index:
+        return -1
+    return vs.get_stats().get("total_vectors", 0)
+
+# index file locations never change at runtime
+_INDEX_FILE = Path(config.VECTOR_STORE_PATH).with_suffix(".index")
+_DOCS_FILE = Path(config.VECTOR_STORE_PATH).with_suffix(".docs")
+# cached presence flag so /health and friends skip the stat syscalls;
+# invalidated by /rebuild and /reset
+_INDEX_PRESENT: Optional[bool] = None
+# monotonic counter bumped whenever the index changes; keys the /stats cache
+_INDEX_VERSION = 0
+
 def index_exists() -> bool:
-    base = Path(config.VECTOR_STORE_PATH)
-    return base.with_suffix(".index").exists() and base.with_suffix(".docs").exists()
+    global _INDEX_PRESENT
+    if _INDEX_PRESENT is None:
+        _INDEX_PRESENT = _INDEX_FILE.exists() and _DOCS_FILE.exists()
+    return _INDEX_PRESENT
 
 def ensure_engine(load_only: bool = True) -> Optional[RAGEngine]:
     global ENGINE, VSTORE
@@ -36,7 +93,8 @@ def ensure_engine(load_only: bool = True) -> Optional[RAGEngine]:
     return ENGINE
 
 # FastAPI app
-app = FastAPI(title="Docs RAG API", version="1.0.0")
+app = FastAPI(title="Docs RAG API", version="1.0.0",
+              default_response_class=ORJSONResponse)  # orjson serializes 2-5x faster than stdlib json
 
 # relax cors for dev/portfolio, tighten for prod
 app.add_middleware(
@@ -51,11 +109,19 @@ app.add_middleware(
 class QueryRequest(BaseModel):
     question: str
     show_citations: bool = True
-    refusal_message: Optional[str] = None
+    refusal_message: str = DEFAULT_REFUSAL  # pydantic supplies the default
 
 class QueryResponse(BaseModel):
     answer: str
 
+class BatchQueryRequest(BaseModel):
+    questions: list[str]
+    show_citations: bool = True
+    refusal_message: str = DEFAULT_REFUSAL
+
+class BatchQueryResponse(BaseModel):
+    answers: list[str]
+
 # startup
 @app.on_event("startup")
 def _startup():
@@ -67,11 +133,10 @@ def _startup():
 def health():
     return {"status": "ok", "index_present": index_exists()}
 
-@app.get("/stats")
-def stats():
-    e = ensure_engine(load_only=True)
-    if not e or not VSTORE:
-        return {"index_present": False}
+@lru_cache(maxsize=2)
+def _stats_for(version: int) -> dict:
+    # the payload only changes when the index does, so key on the version
+    # counter bumped by /rebuild and /reset
     vs_stats = VSTORE.get_stats()
     return {
         "index_present": True,
@@ -80,43 +145,97 @@ def stats():
         "model_name": vs_stats.get("model_name", None),
     }
 
+@app.get("/stats")
+def stats():
+    e = ensure_engine(load_only=True)
+    if not e or not VSTORE:
+        return {"index_present": False}
+    return _stats_for(_INDEX_VERSION)
+
 @app.post("/query", response_model=QueryResponse)
-def query(req: QueryRequest):
+async def query(req: QueryRequest):
     e = ensure_engine(load_only=True)
     if not e:
         raise HTTPException(status_code=409, detail="Index not built. Upload documents and /rebuild first.")
-    answer = e.answer(req.question, refusal_message=req.refusal_message or DEFAULT_REFUSAL)
+    # async path: the LLM call awaits the pooled client instead of tying up
+    # a threadpool worker per in-flight request
+    answer = await e.aanswer(req.question, refusal_message=req.refusal_message)
     if not req.show_citations:
-        # strip citations with the same regex your UI uses
-        import re as _re
-        _cite_re = _re.compile(r"\[source:\s*[^\]]+\]")
-        answer = _cite_re.sub("", answer).strip()
+        answer = _CITE_RE.sub("", answer).strip()
     return QueryResponse(answer=answer)
 
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_batch(req: BatchQueryRequest):
+    """Answer several questions in one call: the dense side runs as a single
+    embed + FAISS search over all questions, and the LLM calls fly concurrently"""
+    e = ensure_engine(load_only=True)
+    if not e:
+        raise HTTPException(status_code=409, detail="Index not built. Upload documents and /rebuild first.")
+    answers = await e.aanswer_batch(req.questions, refusal_message=req.refusal_message)
+    if not req.show_citations:
+        answers = [_CITE_RE.sub("", a).strip() for a in answers]
+    return BatchQueryResponse(answers=answers)
+
 @app.get("/query/stream")
-def query_stream(question: str, refusal_message: Optional[str] = None, show_citations: bool = True):
+async def query_stream(question: str, refusal_message: str = DEFAULT_REFUSAL, show_citations: bool = True):
     e = ensure_engine(load_only=True)
     if not e:
         raise HTTPException(status_code=409, detail="Index not built. Upload documents and /rebuild first.")
 
-    def _generator():
-        buf = []
-        import re as _re
-        _cite_re = _re.compile(r"\[source:\s*[^\]]+\]")
-        for token in e.answer_stream(question, refusal_message=refusal_message or DEFAULT_REFUSAL):
+    # sentinel marking the end of the producer thread
+    _DONE = object()
+
+    async def _generator():
+        # the LLM iterator blocks, so run it on a worker thread and hand
+        # tokens to the event loop through a queue; the async generator
+        # itself never blocks, avoiding per-token thread-pool dispatch
+        loop = asyncio.get_running_loop()
+        # unbounded on purpose: a bounded queue would make put_nowait raise
+        # QueueFull inside a loop callback and silently drop tokens when the
+        # client reads slower than the LLM produces; the backlog is already
+        # capped by MAX_NEW_TOKENS, so memory stays bounded anyway
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def _produce():
+            try:
+                for token in e.answer_stream(question, refusal_message=refusal_message):
+                    loop.call_soon_threadsafe(queue.put_nowait, token)
+            except BaseException as exc:
+                # hand the failure to the consumer; swallowing it here would
+                # end the stream cleanly but silently truncated
+                loop.call_soon_threadsafe(queue.put_nowait, exc)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+        threading.Thread(target=_produce, daemon=True).start()
+
+        # small rolling buffer: flush cleaned text but keep a short tail so a
+        # citation split across token boundaries is still stripped (no O(N^2)
+        # re-scan of the whole answer)
+        buf = ""
+        while True:
+            token = await queue.get()
+            if token is _DONE:
+                break
+            if isinstance(token, BaseException):
+                raise token  # abort the response like the sync generator did
             if show_citations:
                 yield token
             else:
-                buf.append(token)
-                if len(buf) % 5 == 0:  # flush in small chunks
-                    chunk = "".join(buf)
-                    chunk = _cite_re.sub("", chunk)
-                    yield chunk
-                    buf.clear()
+                buf += token
+                if len(buf) > _CITE_TAIL:
+                    cut = len(buf) - _CITE_TAIL
+                    # never cut inside an unclosed citation bracket
+                    lb = buf.rfind("[", 0, cut)
+                    if lb != -1 and buf.find("]", lb, cut) == -1:
+                        cut = lb
+                    if cut > 0:
+                        flushable, buf = buf[:cut], buf[cut:]
+                        chunk = _CITE_RE.sub("", flushable)
+                        if chunk:
+                            yield chunk
         if not show_citations and buf:
-            chunk = "".join(buf)
-            chunk = _cite_re.sub("", chunk)
-            yield chunk
+            yield _CITE_RE.sub("", buf)
 
     return StreamingResponse(_generator(), media_type="text/event-stream")
 
@@ -126,36 +245,64 @@ async def upload(files: list[UploadFile] = File(...)):
     data_dir.mkdir(parents=True, exist_ok=True)
     saved, skipped = [], []
     for f in files:
-        raw = await f.read()
-        h = hashlib.sha256(raw).hexdigest()[:12]
+        # stream to a temp file while hashing incrementally: peak memory is
+        # one chunk instead of the whole upload
+        hasher = _new_content_hasher()
+        tmp = tempfile.NamedTemporaryFile(dir=data_dir, prefix=".upload-", delete=False)
+        try:
+            while chunk := await f.read(_UPLOAD_CHUNK):
+                hasher.update(chunk)
+                tmp.write(chunk)
+            tmp.close()
+        except Exception:
+            # client disconnect / disk error mid-stream: don't leave the
+            # half-written temp file behind in the data dir
+            tmp.close()
+            try:
+                os.unlink(tmp.name)
+            except OSError:
+                pass
+            raise
+        h = _hex12(hasher)
         safe = f.filename.replace("\\", "_").replace("/", "_").strip()
         out = data_dir / f"{h}_{safe}"
         if out.exists():
+            os.unlink(tmp.name)
             skipped.append(f.filename)
         else:
-            out.write_bytes(raw)
+            os.replace(tmp.name, out)  # atomic rename into final name
             saved.append(f.filename)
     return {"saved": saved, "skipped": skipped, "message": "Upload complete. Call /rebuild to index."}
 
 @app.post("/rebuild")
-def rebuild():
+async def rebuild():
     """
     Rebuild index from files in config.DATA_DIR
-    Serialized with a lock to avoid concurrent rebuilds
+    Serialized with an async lock; the build itself runs in a worker process
+    so query traffic stays responsive during long rebuilds
     """
-    with ENGINE_LOCK:
-        processor = DocumentProcessor()
-        docs = processor.process_directory(str(config.DATA_DIR))
-        if not docs:
+    async with _REBUILD_LOCK:
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(_REBUILD_POOL, _rebuild_worker, str(config.DATA_DIR))
+        if vectors == 0:
             raise HTTPException(status_code=400, detail="No supported documents found in data directory.")
-        vs = build_vector_store(docs, force_rebuild=True)
-        if not vs:
+        if vectors < 0:
             raise HTTPException(status_code=500, detail="Failed to build vector store.")
+        # the worker wrote the artifacts to disk; load them into this process
+        # on a thread so the model/index load doesn't block the event loop
+        def _reload() -> Optional[VectorStore]:
+            fresh = VectorStore()
+            return fresh if fresh.load_index(config.VECTOR_STORE_PATH) else None
+        vs = await asyncio.to_thread(_reload)
+        if not vs:
+            raise HTTPException(status_code=500, detail="Failed to load rebuilt vector store.")
         # swap global engine/vector store atomically
-        global VSTORE, ENGINE
+        global VSTORE, ENGINE, _INDEX_PRESENT, _INDEX_VERSION
         VSTORE = vs
         ENGINE = RAGEngine(VSTORE, ChatLLM())
-    return {"status": "ok", "vectors": VSTORE.get_stats().get("total_vectors", 0)}
+        _INDEX_PRESENT = True
+        _INDEX_VERSION += 1
+    return {"status": "ok", "vectors": vectors}
 
 @app.delete("/reset")
 def reset():
@@ -165,7 +312,9 @@ def reset():
     shutil.rmtree(Path(config.MODELS_DIR), ignore_errors=True)
     Path(config.DATA_DIR).mkdir(parents=True, exist_ok=True)
     Path(config.MODELS_DIR).mkdir(parents=True, exist_ok=True)
-    global VSTORE, ENGINE
+    global VSTORE, ENGINE, _INDEX_PRESENT, _INDEX_VERSION
     VSTORE = None
     ENGINE = None
+    _INDEX_PRESENT = False
+    _INDEX_VERSION += 1
     return {"status": "cleared"}
@@ -32,6 +32,18 @@ GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
 LLM_MAX_RETRIES_PER_MODEL = int(os.getenv("LLM_MAX_RETRIES_PER_MODEL", "2"))
 LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "1"))
 
+# opt-in OpenAI-style prompt_cache_key on LLM calls; keyed off the system
+# prompt text so editing the prompt rolls the key automatically
+LLM_PROMPT_CACHE = os.getenv("LLM_PROMPT_CACHE", "0") == "1"
+
+# model racing: fire the fast model and a stronger one in parallel, keep the
+# first valid answer (async path only; doubles token spend when enabled)
+ENABLE_MODEL_RACE = os.getenv("ENABLE_MODEL_RACE", "0") == "1"
+GROQ_RACE_MODELS = [m.strip() for m in
+                    os.getenv("GROQ_RACE_MODELS",
+                              f"{GROQ_MODEL},llama-3.3-70b-versatile").split(",")
+                    if m.strip()]
+
 # Generation parameters
 TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))        # lower = more focused, higher = more creative 
 MAX_NEW_TOKENS = int(os.getenv("LLM_MAX_NEW_TOKENS", "256"))
@@ -40,6 +52,10 @@ MAX_DISTINCT_CITATIONS = int(os.getenv("MAX_DISTINCT_CITATIONS", "3"))      # ma
 
 CACHE_DIR = str(MODELS_DIR)
 
+# let FAISS/BLAS kernels use every core unless the process already chose
+# (the API entrypoint pins a smaller count before importing anything heavy)
+os.environ.setdefault("OMP_NUM_THREADS", str(os.cpu_count() or 1))
+
 # Validate token
 if GROQ_API_KEY:
     print(f"✅ Token loaded: {GROQ_API_KEY[:10]}...")
@@ -50,10 +66,16 @@ else:
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "600"))    # characters per chunk
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))  # overlap between chunks
 MAX_CHUNKS_FOR_CONTEXT = int(os.getenv("MAX_CHUNKS_FOR_CONTEXT", "3"))  # max relevant chunks to include in prompt
-MAX_CONTEXT_LENGTH = int(os.getenv("MAX_CONTEXT_LENGTH", "2500"))   # max context length for LLM
+MAX_CONTEXT_LENGTH = int(os.getenv("MAX_CONTEXT_LENGTH", "2500"))   # max context length for LLM (chars, fallback)
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "640"))    # token budget when tiktoken is available
 
 # Vector store settings
 VECTOR_STORE_PATH = str(MODELS_DIR / "faiss_index")
+MMAP_INDEX = os.getenv("MMAP_INDEX", "1") == "1"    # mmap the FAISS index on load
+
+# Semantic answer cache (0 disables)
+SEMCACHE_SIZE = int(os.getenv("SEMCACHE_SIZE", "512"))      # max cached answers
+SEMCACHE_TAU = float(os.getenv("SEMCACHE_TAU", "0.95"))     # cosine gate for a hit
 
 # Streamlit settings
 PAGE_TITLE = "Chatbot Assistant"
@@ -70,6 +92,16 @@ BM25_MIN_SCORE = float(os.getenv("BM25_MIN_SCORE", "0.1"))
 # Dense
 DENSE_TOP_K = int(os.getenv("DENSE_TOP_K", "6"))
 
+# FAISS GPU offload (needs faiss-gpu; silently stays on CPU otherwise)
+USE_GPU = os.getenv("USE_GPU", "0") == "1"
+
+# ANN index knobs; INDEX_TYPE=auto picks by corpus size at build time
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto").lower()    # auto | flat | hnsw | ivfpq
+HNSW_M = int(os.getenv("HNSW_M", "32"))                 # HNSW graph degree
+PQ_M = int(os.getenv("PQ_M", "0"))                      # PQ subquantizers, 0 = dim//8
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+
 # RRF
 RRF_K = int(os.getenv("RRF_K", "60"))
 FUSED_TOP_K = int(os.getenv("FUSED_TOP_K", str(MAX_CHUNKS_FOR_CONTEXT)))
@@ -0,0 +1,28 @@
+"""Shared upload-content fingerprinting.
+
+Both frontends (the API's /upload and the Streamlit saver) write uploads as
+{hash12}_{filename} into the same data dir, so they must agree on the hash:
+if they diverge, the same file uploaded through each UI is saved - and
+indexed - twice.
+"""
+import hashlib
+
+# upload dedup only needs a fast content fingerprint, not cryptographic strength
+try:
+    from blake3 import blake3 as new_content_hasher
+
+    def hex12(hasher) -> str:
+        return hasher.hexdigest(length=6)  # 12 hex chars
+except ImportError:
+    def new_content_hasher():
+        # blake2b is stdlib and still 2-3x faster than sha256
+        return hashlib.blake2b(digest_size=6)
+
+    def hex12(hasher) -> str:
+        return hasher.hexdigest()
+
+def hash12(data: bytes) -> str:
+    """12-hex-char fingerprint of a byte string in one call"""
+    h = new_content_hasher()
+    h.update(data)
+    return hex12(h)
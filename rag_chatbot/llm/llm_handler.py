@@ -1,12 +1,70 @@
+import asyncio
+import atexit
+import hashlib
+import random
 import time
-from dataclasses import dataclass
-from typing import Optional, Iterator
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Iterator
+import httpx
 from groq import Groq
 import config
 
+# Groq's OpenAI-compatible REST base; used by the async path
+GROQ_API_BASE = "https://api.groq.com/openai/v1"
+
+# one shared sync client + Groq SDK instance: per-ChatLLM Groq() objects
+# would each open their own pool and pay their own TLS handshakes
+_SYNC_HTTP: Optional[httpx.Client] = None
+_GROQ: Optional[Groq] = None
+
+def _get_groq() -> Groq:
+    global _SYNC_HTTP, _GROQ
+    if _GROQ is None:
+        _SYNC_HTTP = httpx.Client(
+            timeout=httpx.Timeout(30.0, connect=2.0),
+            limits=httpx.Limits(max_keepalive_connections=64, keepalive_expiry=60),
+        )
+        atexit.register(_SYNC_HTTP.close)
+        _GROQ = Groq(api_key=config.GROQ_API_KEY, http_client=_SYNC_HTTP)
+    return _GROQ
+
+# one shared async client: keep-alive pooling means concurrent requests
+# reuse TCP/TLS sessions instead of paying a handshake per call
+_ASYNC_HTTP: Optional[httpx.AsyncClient] = None
+
+def _get_async_http() -> httpx.AsyncClient:
+    global _ASYNC_HTTP
+    if _ASYNC_HTTP is None or _ASYNC_HTTP.is_closed:
+        _ASYNC_HTTP = httpx.AsyncClient(
+            base_url=GROQ_API_BASE,
+            headers={"Authorization": f"Bearer {config.GROQ_API_KEY}"},
+            timeout=httpx.Timeout(30.0, connect=2.0),
+            limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60),
+        )
+    return _ASYNC_HTTP
+
+@lru_cache(maxsize=8)
+def _prompt_cache_key(system_prompt: str) -> str:
+    """Stable key for provider-side prompt caching; hashing the prompt text
+    means any edit invalidates the cached prefix automatically"""
+    return "rag-sys-" + hashlib.sha1(system_prompt.encode()).hexdigest()[:12]
+
+def _backoff_delay(attempt: int, base: float) -> float:
+    """Exponential backoff with jitter, capped at 30s: avoids the thundering
+    herd that linear backoff causes when a provider has a blip"""
+    return min(30.0, base * (2 ** attempt)) + random.uniform(0, 0.25 * base)
+
+def _retryable(status: Optional[int]) -> bool:
+    """5xx, 429 and unknown/network errors are worth retrying; other 4xx
+    (bad key, bad request) will fail identically every time"""
+    return status is None or status >= 500 or status == 429
+
 @dataclass
 class LLMConfig:
     model: str = getattr(config, "GROQ_MODEL")
+    # candidates for agenerate_race, fastest first
+    models: List[str] = field(default_factory=lambda: list(config.GROQ_RACE_MODELS))
     temperature: float = config.TEMPERATURE
     max_new_tokens: int = config.MAX_NEW_TOKENS
     max_retries: int = config.LLM_MAX_RETRIES_PER_MODEL
@@ -17,7 +75,7 @@ class ChatLLM:
         if not config.GROQ_API_KEY:
             raise RuntimeError("GROQ_API_KEY not set in .env")
         self.cfg = cfg or LLMConfig()
-        self.client = Groq(api_key=config.GROQ_API_KEY)
+        self.client = _get_groq()  # shared pool across ChatLLM instances
 
     def generate(self, system_prompt: str, user_prompt: str) -> str:
         last_err = None
@@ -32,6 +90,8 @@ class ChatLLM:
                     temperature=self.cfg.temperature,
                     max_tokens=self.cfg.max_new_tokens,
                     stream=False,
+                    extra_body=({"prompt_cache_key": _prompt_cache_key(system_prompt)}
+                                if config.LLM_PROMPT_CACHE else None),
                 )
                 return (resp.choices[0].message.content or "").strip()
             except Exception as e:
@@ -43,26 +103,110 @@ class ChatLLM:
                 if status: print(f"\nstatus: {status}")
                 if text: print(f"\nbody: {text}")
 
-                # retry only on 5xx or unknown
-                if status in (500, 502, 503, 504) or status is None:
-                    time.sleep(self.cfg.backoff_seconds * attempt)
+                # retry only when another attempt can actually succeed
+                if _retryable(status):
+                    time.sleep(_backoff_delay(attempt, self.cfg.backoff_seconds))
                     continue
-                raise RuntimeError(f"Groq error (ststus={status}): {text or repr(e)}")
+                raise RuntimeError(f"Groq error (status={status}): {text or repr(e)}")
         raise RuntimeError(f"Groq call failed after retries (model={self.cfg.model}): {repr(last_err)}")
 
+    async def agenerate(self, system_prompt: str, user_prompt: str,
+                        model: Optional[str] = None) -> str:
+        """Async generate over the shared pooled httpx client; concurrent
+        callers no longer serialize on a blocking SDK call"""
+        model = model or self.cfg.model
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            "temperature": self.cfg.temperature,
+            "max_tokens": self.cfg.max_new_tokens,
+            "stream": False,
+        }
+        if config.LLM_PROMPT_CACHE:
+            # OpenAI-compatible prefix-cache hint; skips prefill on the
+            # shared system prompt when the provider honors it
+            payload["prompt_cache_key"] = _prompt_cache_key(system_prompt)
+        client = _get_async_http()
+        last_err = None
+        for attempt in range(1, self.cfg.max_retries + 1):
+            try:
+                resp = await client.post("/chat/completions", json=payload)
+                status = resp.status_code
+                if status >= 400:
+                    print(f"[GROQ ERROR] attempt{attempt}/{self.cfg.max_retries} model={model} status={status}")
+                    # retry 5xx and 429; other 4xx are unrecoverable
+                    if _retryable(status):
+                        last_err = RuntimeError(f"Groq error (status={status}): {resp.text}")
+                        await asyncio.sleep(_backoff_delay(attempt, self.cfg.backoff_seconds))
+                        continue
+                    raise RuntimeError(f"Groq error (status={status}): {resp.text}")
+                data = resp.json()
+                return (data["choices"][0]["message"]["content"] or "").strip()
+            except httpx.HTTPError as e:
+                # network-level error, worth retrying
+                last_err = e
+                print(f"[GROQ ERROR] attempt{attempt}/{self.cfg.max_retries} model={model}: {repr(e)}")
+                await asyncio.sleep(_backoff_delay(attempt, self.cfg.backoff_seconds))
+        raise RuntimeError(f"Groq call failed after retries (model={model}): {repr(last_err)}")
+
+    async def agenerate_race(self, system_prompt: str, user_prompt: str) -> str:
+        """Race the fast model against a stronger one and keep the first
+        answer that carries a citation; p50 tracks the fast model while p95
+        stays bounded by the strong one. Capped at two models for cost"""
+        models = (self.cfg.models or [self.cfg.model])[:2]
+        if len(models) < 2:
+            return await self.agenerate(system_prompt, user_prompt)
+
+        tasks = [asyncio.create_task(self.agenerate(system_prompt, user_prompt, model=m))
+                 for m in models]
+        fallback, last_err = None, None
+        try:
+            for fut in asyncio.as_completed(tasks):
+                try:
+                    text = await fut
+                except Exception as e:
+                    last_err = e
+                    continue
+                if "[source:" in text:
+                    return text
+                fallback = fallback or text  # valid-looking but uncited
+            if fallback is not None:
+                return fallback
+            raise RuntimeError(f"All raced models failed: {repr(last_err)}")
+        finally:
+            for t in tasks:
+                t.cancel()
+
     def generate_stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
-        """Stream tokens as they are generated"""
+        """Stream tokens as they are generated (retries only cover opening
+        the stream; once tokens flow a failure surfaces as an error chunk)"""
+        stream = None
+        for attempt in range(1, self.cfg.max_retries + 1):
+            try:
+                stream = self.client.chat.completions.create(
+                    model=self.cfg.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    temperature=self.cfg.temperature,
+                    max_tokens=self.cfg.max_new_tokens,
+                    stream=True,
+                    extra_body=({"prompt_cache_key": _prompt_cache_key(system_prompt)}
+                                if config.LLM_PROMPT_CACHE else None),
+                )
+                break
+            except Exception as e:
+                status = getattr(e, "status_code", None) or getattr(e, "status", None)
+                print(f"[GROQ ERROR] attempt{attempt}/{self.cfg.max_retries} model={self.cfg.model}: {repr(e)}")
+                if not _retryable(status) or attempt == self.cfg.max_retries:
+                    yield f"\n\n (stream error: {repr(e)})"
+                    return
+                time.sleep(_backoff_delay(attempt, self.cfg.backoff_seconds))
         try:
-            stream = self.client.chat.completions.create(
-                model=self.cfg.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=self.cfg.temperature,
-                max_tokens=self.cfg.max_new_tokens,
-                stream=True,
-            )
             for chunk in stream:
                 delta = None
                 try:
@@ -1,11 +1,18 @@
+import asyncio
+import hashlib
 import re
-from typing import Optional
+import sys
+import threading
+from concurrent.futures import Future
+from string import Template
+from typing import Dict, List, Optional
 from textwrap import dedent
 from langchain.docstore.document import Document
 from rag_chatbot.stores.vector_store import VectorStore
 from rag_chatbot.llm.llm_handler import ChatLLM
 from rag_chatbot.retrievers.bm25_retriever import BM25Retriever
 from rag_chatbot.retrievers.hybrid_retriever import rrf_fuse
+from rag_chatbot.pipeline.semantic_cache import SemanticAnswerCache
 import config
 
 CITE_RE = re.compile(r"\[source:\s*[^\]]+\]")
@@ -25,19 +32,24 @@ SYSTEM_PROMPT = dedent("""
                         - Prefer lists or short paragraphs. Quote exact phrases when helpful.
 
 """).strip()
+# intern so every request sends the byte-identical prompt: provider-side
+# prefix caches key on the exact text, any drift would miss
+SYSTEM_PROMPT = sys.intern(SYSTEM_PROMPT)
 
-ANSWER_TEMPLATE = """
+# precompiled Template: substitution without re-parsing the format string,
+# and no brace-escaping worries if document text ever leaks into templates
+ANSWER_TEMPLATE = Template("""
 USER QUESTION:
-{question}
+$question
 
 CONTEXT (from policy documents):
-{context}
+$context
 
 INSTRUCTIONS:
 - Answer ONLY based on the context above.
 - If the answer is not supported by the context, say so and suggest what to upload next.
 - Include 1–3 citations like [source: filename §Section]
-"""
+""")
 
 # default fallback when retrieval returns nothing
 DEFAULT_REFUSAL = ("I couldn’t find this in the documents you provided. "
@@ -47,13 +59,29 @@ class RAGEngine:
     def __init__(self, vector_store: VectorStore, llm: ChatLLM):
         self.vs = vector_store
         self.llm = llm
-        self.bm25 = BM25Retriever(self.vs.documents) if config.USE_HYBRID_RETRIEVAL else None
-    
-    def _retrieve(self, question: str):
-        # dense
-        dense = self.vs.topk_with_citations(question, k=config.DENSE_TOP_K)
-        dense = [h for h in dense if h.get("score",0.0) >= config.MIN_COSINE_SIMILARITY]
+        self.bm25 = (BM25Retriever(self.vs.documents, cache_path=config.VECTOR_STORE_PATH)
+                     if config.USE_HYBRID_RETRIEVAL else None)
+        # near-duplicate questions skip retrieval + LLM entirely
+        self.semcache = (SemanticAnswerCache(self.vs.dimension)
+                         if config.SEMCACHE_SIZE > 0 and self.vs.dimension else None)
+        # singleflight: burst-identical questions share one in-flight pipeline
+        # run instead of each paying for their own LLM call
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._ainflight: Dict[str, asyncio.Future] = {}
 
+    def _embed_question(self, question: str):
+        """One normalized query embedding, shared by cache probe and retrieval"""
+        try:
+            # query-side embed path (same one similarity_search uses), not the
+            # document batch path
+            return self.vs._embed_query(question)[0]
+        except Exception as e:
+            print(f"Query embedding failed: {e}")
+            return None
+
+    def _fuse_with_sparse(self, dense, question: str):
+        """Combine filtered dense hits with BM25 via RRF (or pass dense through)"""
         if not config.USE_HYBRID_RETRIEVAL or self.bm25 is None:
             return dense  # vector-only mode
 
@@ -70,9 +98,73 @@ class RAGEngine:
             return dense or sparse
         return fused
 
+    def _retrieve(self, question: str, qvec=None):
+        # dense (reuse the caller's query embedding when available); the
+        # cosine floor is applied inside the store with a vectorized mask
+        dense = self.vs.topk_with_citations(question, k=config.DENSE_TOP_K, query_vec=qvec,
+                                            min_score=config.MIN_COSINE_SIMILARITY)
+        return self._fuse_with_sparse(dense, question)
+
+    def retrieve_batch(self, questions: List[str]):
+        """Retrieve for several questions with one embed + one FAISS search"""
+        dense_lists = self.vs.topk_with_citations_batch(questions, k=config.DENSE_TOP_K,
+                                                        min_score=config.MIN_COSINE_SIMILARITY)
+        return [self._fuse_with_sparse(dense, question)
+                for question, dense in zip(questions, dense_lists)]
+
+    @staticmethod
+    def _flight_key(question: str) -> str:
+        return hashlib.sha1(question.strip().lower().encode()).hexdigest()
+
     def answer(self, question: str, refusal_message: Optional[str] = None) -> str:
+        # singleflight: if an identical question is already running, wait for
+        # its result instead of running the pipeline (and the LLM) again
+        key = self._flight_key(question)
+        with self._inflight_lock:
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = Future()
+                self._inflight[key] = flight
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            return flight.result()
+        try:
+            text = self._answer_once(question, refusal_message)
+            flight.set_result(text)
+            return text
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _answer_once(self, question: str, refusal_message: Optional[str] = None) -> str:
+        # 0. embed once; the same vector serves the cache probe and retrieval
+        qvec = self._embed_question(question)
+        if self.semcache is not None and qvec is not None:
+            cached = self.semcache.get(qvec)
+            if cached is not None:
+                return cached
+
         # 1. retrieve
-        hits = self._retrieve(question)
+        hits = self._retrieve(question, qvec)
+        text = self._answer_from_hits(question, hits, refusal_message)
+
+        # cache real answers only (not refusals or transient engine errors)
+        if self.semcache is not None and qvec is not None and hits and "[source:" in text:
+            self.semcache.put(qvec, text)
+        return text
+
+    def answer_batch(self, questions: List[str], refusal_message: Optional[str] = None) -> List[str]:
+        """Answer several questions, amortizing embedding and FAISS search"""
+        hits_lists = self.retrieve_batch(questions)
+        return [self._answer_from_hits(q, hits, refusal_message)
+                for q, hits in zip(questions, hits_lists)]
+
+    def _answer_from_hits(self, question: str, hits, refusal_message: Optional[str] = None) -> str:
         if not hits:
             return refusal_message or DEFAULT_REFUSAL
 
@@ -80,38 +172,153 @@ class RAGEngine:
         context = self.vs.build_context(hits, max_chars=config.MAX_CONTEXT_LENGTH)
 
         # 3. send to LLM (now guarded)
-        user_prompt = ANSWER_TEMPLATE.format(question=question, context=context)
+        user_prompt = ANSWER_TEMPLATE.substitute(question=question, context=context)
         try:
             text = self.llm.generate(SYSTEM_PROMPT, user_prompt)
         except Exception as e:
             return (f"⚠️ The answer engine had an issue: {e}\n"
                     "Please try again, or ask a slightly shorter question.")
+        return self._postprocess(text)
 
-        # 4. guardrails
+    def _postprocess(self, text: str) -> str:
+        """Guardrails: require a citation, throttle citation count"""
         if "[source:" not in text:
             # no verified citation found, append a gentle nudge (don’t hallucinate)
             text = text.strip() + "\n\n" + (DEFAULT_REFUSAL)
 
-        found = []
-        def _keep_first_n(m):
-            if len(found) < config.MAX_DISTINCT_CITATIONS:
-                found.append(m.group(0))
-                return m.group(0)
-            return ""
-        text = CITE_RE.sub(_keep_first_n, text)
-        return text.strip()
-    
+        # single manual scan: no regex engine, no per-match callback
+        out, i, kept = [], 0, 0
+        while True:
+            j = text.find("[source:", i)
+            if j == -1:
+                out.append(text[i:])
+                break
+            k = text.find("]", j)
+            if k == -1:
+                out.append(text[i:])
+                break
+            out.append(text[i:j])
+            if kept < config.MAX_DISTINCT_CITATIONS:
+                out.append(text[j:k+1])
+                kept += 1
+            i = k + 1
+        return "".join(out).strip()
+
+    async def aanswer(self, question: str, refusal_message: Optional[str] = None) -> str:
+        """Async answer with singleflight: concurrent identical questions
+        share one pipeline run"""
+        key = self._flight_key(question)
+        flight = self._ainflight.get(key)  # single event loop, no lock needed
+        if flight is not None:
+            return await flight
+        flight = asyncio.get_running_loop().create_future()
+        self._ainflight[key] = flight
+        try:
+            text = await self._aanswer_once(question, refusal_message)
+            flight.set_result(text)
+            return text
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            self._ainflight.pop(key, None)
+
+    async def _aanswer_once(self, question: str, refusal_message: Optional[str] = None) -> str:
+        """Async answer: retrieval runs on a worker thread, the LLM call
+        awaits the shared pooled httpx client"""
+        qvec = await asyncio.to_thread(self._embed_question, question)
+        if self.semcache is not None and qvec is not None:
+            cached = self.semcache.get(qvec)
+            if cached is not None:
+                return cached
+
+        hits = await asyncio.to_thread(self._retrieve, question, qvec)
+        text = await self._aanswer_from_hits(question, hits, refusal_message)
+
+        if self.semcache is not None and qvec is not None and hits and "[source:" in text:
+            self.semcache.put(qvec, text)
+        return text
+
+    async def _aanswer_from_hits(self, question: str, hits, refusal_message: Optional[str] = None) -> str:
+        if not hits:
+            return refusal_message or DEFAULT_REFUSAL
+
+        context = self.vs.build_context(hits, max_chars=config.MAX_CONTEXT_LENGTH)
+        user_prompt = ANSWER_TEMPLATE.substitute(question=question, context=context)
+        try:
+            if config.ENABLE_MODEL_RACE:
+                text = await self.llm.agenerate_race(SYSTEM_PROMPT, user_prompt)
+            else:
+                text = await self.llm.agenerate(SYSTEM_PROMPT, user_prompt)
+        except Exception as e:
+            return (f"⚠️ The answer engine had an issue: {e}\n"
+                    "Please try again, or ask a slightly shorter question.")
+        return self._postprocess(text)
+
+    async def aanswer_batch(self, questions: List[str], refusal_message: Optional[str] = None) -> List[str]:
+        """Async batch answer: one embed + FAISS search on a worker thread,
+        then all LLM calls in flight concurrently on the shared client"""
+        hits_lists = await asyncio.to_thread(self.retrieve_batch, questions)
+        return list(await asyncio.gather(*(
+            self._aanswer_from_hits(q, hits, refusal_message)
+            for q, hits in zip(questions, hits_lists))))
+
     def answer_stream(self, question: str, refusal_message: Optional[str] = None):
         """Stream tokens as they generate"""
-        hits = self._retrieve(question)
+        qvec = self._embed_question(question)
+        if self.semcache is not None and qvec is not None:
+            cached = self.semcache.get(qvec)
+            if cached is not None:
+                # cache hit: yield the whole answer at once
+                yield cached
+                return
+
+        hits = self._retrieve(question, qvec)
         if not hits:
             # yield a one-shot refusal so streamlit displays something
             yield (refusal_message or DEFAULT_REFUSAL)
             return
 
         context = self.vs.build_context(hits, max_chars=config.MAX_CONTEXT_LENGTH)
-        user_prompt = ANSWER_TEMPLATE.format(question=question, context=context)
+        user_prompt = ANSWER_TEMPLATE.substitute(question=question, context=context)
 
-        # delegate token streaming to the LLM client
+        # delegate token streaming to the LLM client; throttle citations on
+        # the accumulated buffer as they complete (not a regex pass per token)
+        produced = []
+        pending, kept = "", 0
         for token in self.llm.generate_stream(SYSTEM_PROMPT, user_prompt):
-            yield token
\ No newline at end of file
+            pending += token
+            out, pending, kept = self._throttle_citations(pending, kept)
+            if out:
+                produced.append(out)
+                yield out
+        if pending:
+            out, _, kept = self._throttle_citations(pending, kept, final=True)
+            if out:
+                produced.append(out)
+                yield out
+
+        if self.semcache is not None and qvec is not None:
+            full = "".join(produced)
+            if "[source:" in full:
+                self.semcache.put(qvec, full)
+
+    def _throttle_citations(self, buf: str, kept: int, final: bool = False):
+        """Keep the first MAX_DISTINCT_CITATIONS citations in buf, drop the
+        rest; unless final, hold back a possibly unfinished citation tail"""
+        out, pos = [], 0
+        for m in CITE_RE.finditer(buf):
+            out.append(buf[pos:m.start()])
+            if kept < config.MAX_DISTINCT_CITATIONS:
+                out.append(m.group(0))
+                kept += 1
+            pos = m.end()
+        rest = buf[pos:]
+        cut = rest.rfind("[")
+        if not final and cut != -1 and "]" not in rest[cut:]:
+            out.append(rest[:cut])
+            rest = rest[cut:]  # may be the start of a citation, wait for more
+        else:
+            out.append(rest)
+            rest = ""
+        return "".join(out), rest, kept
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Semantic answer cache for the RAG engine
+Maps near-duplicate questions onto previously generated answers via a small
+FAISS inner-product index over l2-normalized query embeddings
+"""
+import threading
+import time
+from typing import List, Optional
+import numpy as np
+import faiss
+import config
+
+class SemanticAnswerCache:
+    """Bounded cache: a cosine hit above tau returns the stored answer,
+    turning a full retrieval+LLM round-trip into one FAISS probe"""
+    def __init__(self, dimension: int,
+                 capacity: int = config.SEMCACHE_SIZE,
+                 tau: float = config.SEMCACHE_TAU):
+        self.dimension = dimension
+        self.capacity = capacity
+        self.tau = tau
+        self.index = faiss.IndexFlatIP(dimension)
+        self.vectors: List[np.ndarray] = []
+        self.answers: List[str] = []
+        self.ts: List[float] = []   # last-hit time, drives eviction
+        self.lock = threading.Lock()
+
+    def get(self, query_vec: np.ndarray) -> Optional[str]:
+        """Return the cached answer for the nearest stored query, or None"""
+        vec = np.asarray(query_vec, dtype="float32").reshape(1, -1)
+        with self.lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, idxs = self.index.search(vec, 1)
+            idx = int(idxs[0][0])
+            if idx == -1 or float(scores[0][0]) < self.tau:
+                return None
+            self.ts[idx] = time.time()
+            return self.answers[idx]
+
+    def put(self, query_vec: np.ndarray, answer: str):
+        vec = np.asarray(query_vec, dtype="float32").reshape(1, -1)
+        with self.lock:
+            self.vectors.append(vec[0])
+            self.answers.append(answer)
+            self.ts.append(time.time())
+            self.index.add(vec)
+            if len(self.answers) > self.capacity:
+                self._evict_lru()
+
+    def _evict_lru(self):
+        """Keep the most recently used half and rebuild the flat index"""
+        keep = sorted(range(len(self.ts)), key=lambda i: self.ts[i],
+                      reverse=True)[: max(1, self.capacity // 2)]
+        keep.sort()  # preserve insertion order among survivors
+        self.vectors = [self.vectors[i] for i in keep]
+        self.answers = [self.answers[i] for i in keep]
+        self.ts = [self.ts[i] for i in keep]
+        self.index = faiss.IndexFlatIP(self.dimension)
+        if self.vectors:
+            self.index.add(np.stack(self.vectors))
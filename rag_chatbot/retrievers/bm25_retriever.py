@@ -1,25 +1,213 @@
 import re
+import gzip
+import hashlib
+import pickle
+from multiprocessing import Pool
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+try:
+    import bm25s  # sparse-matrix scoring, orders of magnitude faster than rank_bm25
+except ImportError:
+    bm25s = None
+try:
+    from scipy import sparse as sp
+except ImportError:
+    sp = None
 from rank_bm25 import BM25Okapi
 
 def _tokenize(text: str) -> List[str]:
     # simple, fast tokenizer, add another later
     return re.findall(r"[A-Za-z0-9_]+", text.lower())
 
+# below this corpus size the worker pool costs more than it saves
+_PARALLEL_TOKENIZE_MIN = 512
+
+def _tokenize_corpus(texts: List[str]) -> List[List[str]]:
+    """Tokenize the corpus, fanning out across cores for larger ones"""
+    if len(texts) >= _PARALLEL_TOKENIZE_MIN:
+        with Pool() as pool:
+            return pool.map(_tokenize, texts, chunksize=64)
+    return [_tokenize(t) for t in texts]
+
+class _CsrBM25:
+    """BM25 scoring as one sparse matrix-vector product: the BM25 tf
+    transform is baked into a csr matrix at build time, so a query costs a
+    tiny column slice + BLAS dot instead of rank_bm25's per-token python
+    loop over the corpus. Drop-in for BM25Okapi's get_scores"""
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, corpus_tokens: List[List[str]]):
+        vocab: Dict[str, int] = {}
+        indptr, indices, data = [0], [], []
+        for toks in corpus_tokens:
+            counts: Dict[int, int] = {}
+            for t in toks:
+                idx = vocab.setdefault(t, len(vocab))
+                counts[idx] = counts.get(idx, 0) + 1
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        n, v = len(corpus_tokens), max(len(vocab), 1)
+        tf = sp.csr_matrix(
+            (np.asarray(data, dtype=np.float64),
+             np.asarray(indices, dtype=np.int64),
+             np.asarray(indptr, dtype=np.int64)),
+            shape=(n, v))
+
+        doc_len = np.asarray(tf.sum(axis=1)).ravel()
+        avgdl = doc_len.mean() if n else 1.0
+        # tf * (k1+1) / (tf + k1*(1 - b + b*|d|/avgdl)), applied per nonzero
+        denom_row = self.K1 * (1 - self.B + self.B * doc_len / (avgdl or 1.0))
+        rows = np.repeat(np.arange(n), np.diff(tf.indptr))
+        tf.data = tf.data * (self.K1 + 1) / (tf.data + denom_row[rows])
+
+        # each (doc, term) pair appears once, so bincount over the column
+        # indices is exactly document frequency
+        df = np.bincount(tf.indices, minlength=v)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+        self.matrix = tf.tocsc()  # queries slice columns
+        self.vocab = vocab
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        counts: Dict[int, int] = {}
+        for t in query_tokens:
+            idx = self.vocab.get(t)
+            if idx is not None:
+                counts[idx] = counts.get(idx, 0) + 1
+        if not counts:
+            return np.zeros(self.matrix.shape[0])
+        cols = np.fromiter(counts.keys(), dtype=np.int64)
+        qtf = np.fromiter(counts.values(), dtype=np.float64)
+        return self.matrix[:, cols] @ (qtf * self.idf[cols])
+
+def _tokens_cache_file(cache_path: str) -> str:
+    return f"{cache_path}.bm25.tokens.gz"
+
+def _state_cache_file(cache_path: str) -> str:
+    return f"{cache_path}.bm25.state.gz"
+
 class BM25Retriever:
-    def __init__(self, docs: List[Any]):
+    def __init__(self, docs: List[Any], cache_path: Optional[str] = None):
         self.docs = docs
-        self.corpus_tokens = [ _tokenize(d.page_content) for d in docs ]
-        self.bm25 = BM25Okapi(self.corpus_tokens)
+        self.corpus_tokens = None
+        self.bm25 = None
+        self.retriever = None
+        # content fingerprint: a rebuild that changes text but keeps the
+        # chunk count must still invalidate the caches below
+        self.corpus_hash = self._corpus_hash(docs)
+        # best case: a fully-built scorer from a previous run, skipping both
+        # tokenization and inverted-index construction at startup
+        if cache_path and self._load_state(cache_path):
+            return
+        # second best: cached corpus tokens, only rebuild the index
+        if cache_path:
+            self.corpus_tokens = self._load_tokens(cache_path)
+        if self.corpus_tokens is None:
+            self.corpus_tokens = _tokenize_corpus([d.page_content for d in docs])
+            if cache_path:
+                self._save_tokens(cache_path)
+        if bm25s is not None:
+            # bm25s scores a query as one scipy sparse matrix-vector product
+            self.retriever = bm25s.BM25()
+            self.retriever.index(self.corpus_tokens, show_progress=False)
+        elif sp is not None:
+            # vectorized fallback, same idea as bm25s built by hand
+            self.bm25 = _CsrBM25(self.corpus_tokens)
+        else:
+            self.bm25 = BM25Okapi(self.corpus_tokens)
+        if cache_path:
+            self._save_state(cache_path)
+
+    @staticmethod
+    def _corpus_hash(docs: List[Any]) -> str:
+        """Fingerprint of the chunk texts; hashing is far cheaper than
+        tokenizing, so this is a rounding error next to a cache miss"""
+        h = hashlib.blake2b(digest_size=8)
+        for d in docs:
+            t = d.page_content.encode()
+            h.update(len(t).to_bytes(4, "little"))
+            h.update(t)
+        return h.hexdigest()
+
+    def _save_state(self, cache_path: str):
+        """Persist the built scorer so the next process start is one unpickle"""
+        try:
+            state = {
+                'corpus_hash': self.corpus_hash,
+                'backend': 'bm25s' if self.retriever is not None else 'okapi',
+                'scorer': self.retriever if self.retriever is not None else self.bm25,
+            }
+            with gzip.open(_state_cache_file(cache_path), 'wb') as f:
+                pickle.dump(state, f)
+        except Exception as e:
+            print(f"Error saving BM25 state cache: {e}")
+
+    def _load_state(self, cache_path: str) -> bool:
+        try:
+            cache_file = Path(_state_cache_file(cache_path))
+            if not cache_file.exists():
+                return False
+            with gzip.open(cache_file, 'rb') as f:
+                state = pickle.load(f)
+            # stale (any chunk text changed, not just the count) or built
+            # with a backend we don't have; pre-hash caches also land here
+            if state.get('corpus_hash') != self.corpus_hash:
+                return False
+            backend = state.get('backend')
+            if backend == 'bm25s' and bm25s is not None:
+                self.retriever = state['scorer']
+                return True
+            if backend == 'okapi' and bm25s is None:
+                self.bm25 = state['scorer']
+                return True
+            return False
+        except Exception as e:
+            print(f"Error loading BM25 state cache: {e}")
+            return False
+
+    def _save_tokens(self, cache_path: str):
+        try:
+            payload = {'corpus_hash': self.corpus_hash, 'tokens': self.corpus_tokens}
+            with gzip.open(_tokens_cache_file(cache_path), 'wb') as f:
+                pickle.dump(payload, f)
+        except Exception as e:
+            print(f"Error saving BM25 token cache: {e}")
+
+    def _load_tokens(self, cache_path: str) -> Optional[List[List[str]]]:
+        try:
+            cache_file = Path(_tokens_cache_file(cache_path))
+            if not cache_file.exists():
+                return None
+            with gzip.open(cache_file, 'rb') as f:
+                payload = pickle.load(f)
+            # stale (any chunk text changed) or pre-hash format -> retokenize
+            if not isinstance(payload, dict) or payload.get('corpus_hash') != self.corpus_hash:
+                return None
+            return payload['tokens']
+        except Exception as e:
+            print(f"Error loading BM25 token cache: {e}")
+            return None
+
+    def _topk_pairs(self, q: List[str], k: int) -> List[Tuple[int, float]]:
+        """Return best-first [(doc_index, score), ...] for a tokenized query"""
+        if self.retriever is not None:
+            idxs, scores = self.retriever.retrieve(
+                [q], k=min(k, len(self.docs)), show_progress=False)
+            return [(int(i), float(s)) for i, s in zip(idxs[0], scores[0])]
+        scores = np.asarray(self.bm25.get_scores(q))
+        # O(N) partial selection in C instead of sorting the whole corpus
+        # with a python-level key function, then sort only the k winners
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        idxs = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in idxs]
 
     def topk(self, query: str, k: int = 20) -> List[Dict]:
         q = _tokenize(query)
-        scores = self.bm25.get_scores(q)
-        # collect top-k indices by score
-        idxs = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
         results = []
-        for rank, i in enumerate(idxs, start=1):
+        for rank, (i, score) in enumerate(self._topk_pairs(q, k), start=1):
             d = self.docs[i]
             source_full = d.metadata.get("source", "unknown")
             source_name = Path(source_full).name            # use filename
@@ -29,11 +217,12 @@ class BM25Retriever:
                           d.metadata.get("chunk_in_section", i))
             results.append({
                 "doc": d,
-                "score": float(scores[i]),
+                "score": score,
                 "rank": rank,
                 "source": source_name,  # match dense
                 "section_path": section_path,
                 "chunk_index": chunk_idx,
+                "citation": source_name + (f" §{section_path}" if section_path else ""),
                 "uid": (source_name, section_path, chunk_idx),  # mattch dense
             })
         return results
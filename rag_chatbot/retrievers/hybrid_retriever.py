@@ -1,36 +1,117 @@
-from typing import List, Dict
+import heapq
+from typing import Dict, List, Tuple
+import numpy as np
+try:
+    from numba import njit  # optional: JIT fusion kernel for wide candidate pools
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
 import config
 
+# below this many candidates the dict-based python path beats JIT dispatch
+_NUMBA_MIN_HITS = 64
+
+if _HAS_NUMBA:
+    @njit(cache=True)
+    def _segment_sums(hashes_sorted, contribs_sorted):
+        """Sum RRF contributions per run of equal uid hashes.
+        Returns (scores, run_start_offsets) for the unique uids"""
+        n = hashes_sorted.shape[0]
+        scores = np.empty(n, np.float64)
+        starts = np.empty(n, np.int64)
+        m = 0
+        i = 0
+        while i < n:
+            j = i
+            s = 0.0
+            while j < n and hashes_sorted[j] == hashes_sorted[i]:
+                s += contribs_sorted[j]
+                j += 1
+            scores[m] = s
+            starts[m] = i
+            m += 1
+            i = j
+        return scores[:m], starts[:m]
+
+def _rrf_fuse_numba(dense_hits: List[Dict], sparse_hits: List[Dict]) -> List[Dict]:
+    all_hits = dense_hits + sparse_hits
+    n = len(all_hits)
+    hashes = np.fromiter((hash(h["uid"]) for h in all_hits), np.int64, n)
+    ranks = np.fromiter((h.get("rank", 9999) for h in all_hits), np.int64, n)
+    contribs = 1.0 / (config.RRF_K + ranks)
+
+    # stable sort keeps the first-seen hit first within each uid group
+    order = np.argsort(hashes, kind="mergesort")
+    scores, starts = _segment_sums(hashes[order], contribs[order])
+
+    k = min(config.FUSED_TOP_K, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+
+    # per-branch scores only for the K winners
+    win_hashes = {int(hashes[order[starts[t]]]) for t in top}
+    dense_by_hash = {hash(h["uid"]): h.get("score") for h in dense_hits
+                     if hash(h["uid"]) in win_hashes}
+    sparse_by_hash = {hash(h["uid"]): h.get("score") for h in sparse_hits
+                      if hash(h["uid"]) in win_hashes}
+
+    fused = []
+    for t in top:
+        h = all_hits[order[starts[t]]]
+        uid_hash = hash(h["uid"])
+        fused.append({
+            "doc": h["doc"],
+            "source": h["source"],
+            "section_path": h.get("section_path", ""),
+            "chunk_index": h.get("chunk_index", 0),
+            "citation": h.get("citation", ""),
+            "dense_score": dense_by_hash.get(uid_hash),
+            "sparse_score": sparse_by_hash.get(uid_hash),
+            "rrf_score": float(scores[t]),
+        })
+    return fused
+
 def rrf_fuse(dense_hits: List[Dict], sparse_hits: List[Dict]) -> List[Dict]:
-    # build dicts keyed by uid
-    fused = {}
+    if _HAS_NUMBA and len(dense_hits) + len(sparse_hits) >= _NUMBA_MIN_HITS:
+        return _rrf_fuse_numba(dense_hits, sparse_hits)
+
+    # accumulate scores in parallel maps keyed by uid (SoA) instead of
+    # allocating a result dict per candidate up front
+    rrf_scores: Dict[Tuple, float] = {}
+    dense_scores: Dict[Tuple, float] = {}
+    sparse_scores: Dict[Tuple, float] = {}
+    meta: Dict[Tuple, Tuple] = {}
+
     def add_list(hits, kind):
         for h in hits:
             uid = h["uid"]
             rank = h.get("rank", 9999)
             # RRF contribution
-            contrib = 1.0 / (config.RRF_K + rank)
-            if uid not in fused:
-                fused[uid] = {
-                    "doc": h["doc"],
-                    "source": h["source"],
-                    "section_path": h.get("section_path",""),
-                    "chunk_index": h.get("chunk_index", 0),
-                    "citation": h.get("citation",""),
-                    "dense_score": None,
-                    "sparse_score": None,
-                    "rrf_score": 0.0,
-                }
-            fused[uid]["rrf_score"] += contrib
+            rrf_scores[uid] = rrf_scores.get(uid, 0.0) + 1.0 / (config.RRF_K + rank)
+            if uid not in meta:
+                meta[uid] = (h["doc"], h["source"], h.get("section_path", ""),
+                             h.get("chunk_index", 0), h.get("citation", ""))
             if kind == "dense":
-                fused[uid]["dense_score"] = h.get("score")
+                dense_scores[uid] = h.get("score")
             else:
-                fused[uid]["sparse_score"] = h.get("score")
+                sparse_scores[uid] = h.get("score")
 
     add_list(dense_hits, "dense")
     add_list(sparse_hits, "sparse")
 
-    # sort by fused score, keep top K
-    items = list(fused.values())
-    items.sort(key=lambda x: x["rrf_score"], reverse=True)
-    return items[:config.FUSED_TOP_K]
+    # O(N log k) heap selection; only the K winners get materialized as dicts
+    top = heapq.nlargest(config.FUSED_TOP_K, rrf_scores.items(), key=lambda kv: kv[1])
+    fused = []
+    for uid, score in top:
+        doc, source, section_path, chunk_index, citation = meta[uid]
+        fused.append({
+            "doc": doc,
+            "source": source,
+            "section_path": section_path,
+            "chunk_index": chunk_index,
+            "citation": citation,
+            "dense_score": dense_scores.get(uid),
+            "sparse_score": sparse_scores.get(uid),
+            "rrf_score": score,
+        })
+    return fused
@@ -2,16 +2,119 @@
 Vector store management using FAISS for similarity search
 Handles embedding creation, storage, and retrieval using FastEmbed
 """
+import json
 import os
 import pickle
+import threading
 import numpy as np
 import faiss
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Tuple, Optional, Dict
 from fastembed import TextEmbedding
 from langchain.docstore.document import Document
 import config
 
+# columnar docs sidecar: much faster to (de)serialize than pickled Documents
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    _HAS_ARROW = True
+except ImportError:
+    _HAS_ARROW = False
+
+# token-accurate context budgeting; prefill cost scales with tokens, and a
+# char proxy over/under-shoots by 20-40%. cl100k_base is close enough for
+# llama-family tokenizers, and without tiktoken we budget by chars as before
+try:
+    import tiktoken
+    _TOKEN_ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _TOKEN_ENC = None
+
+@lru_cache(maxsize=8192)
+def _token_len(text: str) -> int:
+    return len(_TOKEN_ENC.encode(text))
+
+# bounded LRU of loaded FastEmbed models keyed by (model_name, cache_dir):
+# model load is the most expensive part of VectorStore construction, so
+# rebuilds and model swaps reuse an already-loaded instance
+_MODEL_CACHE: "OrderedDict[tuple, TextEmbedding]" = OrderedDict()
+_MODEL_CACHE_LOCK = threading.Lock()
+_MODEL_CACHE_MAX = 2
+
+# embedding batch size for indexing; larger batches amortize ONNX dispatch
+_EMBED_BATCH_SIZE = 64
+# below this many texts the parallel-embed worker startup costs more than it saves
+_PARALLEL_EMBED_MIN = 256
+# corpus-size thresholds for picking the index type in create_index
+_HNSW_MIN_DOCS = 2_000      # below this a flat scan is already fast
+_IVFPQ_MIN_DOCS = 50_000    # above this HNSW memory gets heavy
+# bound for the per-store single-query embedding LRU
+_EMB_CACHE_MAX = 4096
+# bound for the per-store (query, k) -> top-k results LRU
+_QUERY_CACHE_MAX = 256
+
+# run the ONNX model on GPU when the runtime actually has CUDA; fastembed
+# ignores the kwarg gracefully but an unavailable provider would just warn-
+# and-fall-back anyway, so only ask for it when it exists
+_ORT_PROVIDERS = None
+try:
+    import onnxruntime as _ort
+    if "CUDAExecutionProvider" in _ort.get_available_providers():
+        _ORT_PROVIDERS = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+except ImportError:
+    pass
+
+# model_name -> embedding dimension, persisted so cold starts skip the
+# probe inference entirely (st.cache_resource only helps within a process)
+_DIM_CACHE_PATH = Path(config.CACHE_DIR) / "embed_dims.json"
+
+def _load_cached_dim(model_name: str) -> Optional[int]:
+    try:
+        with open(_DIM_CACHE_PATH) as f:
+            return json.load(f).get(model_name)
+    except Exception:
+        return None
+
+def _save_cached_dim(model_name: str, dimension: int):
+    try:
+        dims = {}
+        if _DIM_CACHE_PATH.exists():
+            with open(_DIM_CACHE_PATH) as f:
+                dims = json.load(f)
+        dims[model_name] = dimension
+        with open(_DIM_CACHE_PATH, 'w') as f:
+            json.dump(dims, f)
+    except Exception as e:
+        print(f"Error saving embedding dimension cache: {e}")
+
+def _get_embedding_model(model_name: str, cache_dir: str) -> TextEmbedding:
+    key = (model_name, cache_dir)
+    with _MODEL_CACHE_LOCK:
+        model = _MODEL_CACHE.get(key)
+        if model is not None:
+            _MODEL_CACHE.move_to_end(key)
+            return model
+    threads = os.cpu_count() or 1
+    try:
+        if _ORT_PROVIDERS:
+            model = TextEmbedding(model_name=model_name, cache_dir=cache_dir,
+                                  providers=_ORT_PROVIDERS, threads=threads)
+        else:
+            model = TextEmbedding(model_name=model_name, cache_dir=cache_dir,
+                                  threads=threads)
+    except Exception:
+        # CPU-only fallback if the GPU provider refuses to initialize
+        model = TextEmbedding(model_name=model_name, cache_dir=cache_dir)
+    with _MODEL_CACHE_LOCK:
+        _MODEL_CACHE[key] = model
+        _MODEL_CACHE.move_to_end(key)
+        while len(_MODEL_CACHE) > _MODEL_CACHE_MAX:
+            _MODEL_CACHE.popitem(last=False)  # evict oldest to bound RAM
+    return model
+
 class VectorStore:
     """FAISS-based vector store for document similarity search"""
     def __init__(self, model_name: str = config.EMBEDDING_MODEL):
@@ -20,6 +123,26 @@ class VectorStore:
         self.index = None
         self.documents = []
         self.dimension = None
+        # query text -> normalized (1, d) embedding; deterministic per model
+        self._emb_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # (query, k) -> top-k results; valid until the index changes
+        self._query_cache: "OrderedDict[tuple, list]" = OrderedDict()
+        # id(doc) -> precomputed citation fields, built with the index
+        self._decorations: Dict[int, Dict] = {}
+        # corpus embedding matrix, kept so reindex() can skip re-embedding
+        self._embeddings: Optional[np.ndarray] = None
+        # FAISS GPU offload: resources exist only in faiss-gpu builds with a
+        # visible device, so probe once and remember
+        self._gpu_res = None
+        if config.USE_GPU:
+            try:
+                self._gpu_res = faiss.StandardGpuResources()
+            except Exception as e:
+                print(f"FAISS GPU unavailable, staying on CPU: {e}")
+        # invariant: everything added to the index is already l2-normalized
+        # (create_embeddings normalizes once), so IP scores are cosine and no
+        # corpus-wide normalize_L2 pass is ever needed on save/reload
+        self._is_normalized = True
         # load or initialize embedding model
         self._load_embedding_model()
     
@@ -28,15 +151,10 @@ class VectorStore:
         try:
             print(f"Loading FastEmbed model: {self.model_name}")
             
-            # initialize FastEmbed TextEmbedding
-            self.embedding_model = TextEmbedding(
-                model_name=self.model_name,
-                cache_dir=config.CACHE_DIR
-            )
-            
-            # get embedding dimension by testing with sample text
-            sample_embeddings = list(self.embedding_model.embed(["test"]))
-            self.dimension = len(sample_embeddings[0])
+            # initialize FastEmbed TextEmbedding (cached across instances)
+            self.embedding_model = _get_embedding_model(self.model_name, config.CACHE_DIR)
+
+            self._resolve_dimension()
             print(f"FastEmbed model loaded successfully. Dimension: {self.dimension}")
             
         except Exception as e:
@@ -45,37 +163,75 @@ class VectorStore:
             try:
                 # fallback to a more reliable model
                 self.model_name = "BAAI/bge-small-en-v1.5"
-                self.embedding_model = TextEmbedding(
-                    model_name=self.model_name,
-                    cache_dir=config.CACHE_DIR
-                )
-                sample_embeddings = list(self.embedding_model.embed(["test"]))
-                self.dimension = len(sample_embeddings[0])
+                self.embedding_model = _get_embedding_model(self.model_name, config.CACHE_DIR)
+                self._resolve_dimension()
                 print(f"Fallback model loaded. Dimension: {self.dimension}")
             except Exception as e2:
                 print(f"Fallback also failed: {str(e2)}")
                 raise e2
     
+    def _resolve_dimension(self):
+        """Warm the model with a chunk-sized batch - kernel init/autotune is
+        paid here at startup, never by the first real query - and take the
+        dimension from the cross-process cache when it already knows it"""
+        warmup = ["x " * (config.CHUNK_SIZE // 2)] * 4
+        sample_embeddings = list(self.embedding_model.embed(warmup))
+        cached = _load_cached_dim(self.model_name)
+        if cached:
+            self.dimension = cached
+            return
+        self.dimension = len(sample_embeddings[0])
+        _save_cached_dim(self.model_name, self.dimension)
+
     def create_embeddings(self, texts: List[str]) -> np.ndarray:
         """Create embeddings for list of texts using FastEmbed"""
         try:
             if self.embedding_model is None:
                 raise ValueError("Embedding model is not initialized.")
+
             print(f"Creating embeddings for {len(texts)} texts...")
-            
-            # fastEmbed returns a generator, convert to list
-            embeddings_list = list(self.embedding_model.embed(texts))
-            embeddings = np.array(embeddings_list, dtype="float32")
-            
-            # l2-normalize so inner product == cosine similarity
-            norms = np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
-            embeddings = embeddings / norms
+
+            # fastEmbed yields one vector at a time; stream straight into a
+            # preallocated buffer instead of list(...) + np.array(...), which
+            # held two full copies plus a python list object per vector
+            embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+            # parallel=0 fans the encode out over all cores; only worth the
+            # worker startup for corpus-sized batches
+            parallel = 0 if len(texts) >= _PARALLEL_EMBED_MIN else None
+            for i, vec in enumerate(self.embedding_model.embed(
+                    texts, batch_size=_EMBED_BATCH_SIZE, parallel=parallel)):
+                embeddings[i] = vec
+
+            # l2-normalize in place so inner product == cosine similarity;
+            # faiss's SIMD kernel avoids the temp norms array and the extra
+            # pass that the numpy norm+divide version paid
+            faiss.normalize_L2(embeddings)
+
             print(f"Embeddings created: shape {embeddings.shape}")
             return embeddings
-            
+
         except Exception as e:
             print(f"Error creating embeddings: {str(e)}")
             raise e
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        """Embed one query via fastembed's query_embed fast path (a couple of
+        allocations instead of the list + np.array batch plumbing), with the
+        per-store LRU in front so repeat questions skip the model entirely"""
+        cached = self._emb_cache.get(query)
+        if cached is not None:
+            self._emb_cache.move_to_end(query)
+            return cached
+        try:
+            vec = next(iter(self.embedding_model.query_embed([query])))
+        except AttributeError:
+            vec = next(iter(self.embedding_model.embed([query])))
+        arr = np.asarray(vec, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(arr)
+        self._emb_cache[query] = arr
+        while len(self._emb_cache) > _EMB_CACHE_MAX:
+            self._emb_cache.popitem(last=False)
+        return arr
     
     def create_index(self, documents: List[Document]) -> bool:
         """Create FAISS index from documents"""
@@ -92,34 +248,170 @@ class VectorStore:
             self.documents = documents
             # extract texts for embedding
             texts = [doc.page_content for doc in documents]
-            # create embeddings
-            embeddings = self.create_embeddings(texts)
-            # create FAISS index use inner product with IDMap, embeddings l2-normalized -> cosine
-            base = faiss.IndexFlatIP(self.dimension)
-            self.index = faiss.IndexIDMap(base)
-            ids = np.arange(len(embeddings), dtype=np.int64)
-            self.index.add_with_ids(embeddings.astype("float32"), ids)
+            # embed each distinct text once and scatter back: boilerplate
+            # headers/footers chunk into identical strings, and the ONNX
+            # forward pass is the most expensive step of the build
+            text_to_idx: Dict[str, int] = {}
+            back = []
+            for t in texts:
+                idx = text_to_idx.setdefault(t, len(text_to_idx))
+                back.append(idx)
+            unique = list(text_to_idx)
+            if len(unique) < len(texts):
+                print(f"Embedding {len(unique)} unique texts ({len(texts) - len(unique)} duplicates skipped)")
+            # embeddings are already l2-normalized, see _is_normalized
+            embeddings = self.create_embeddings(unique)
+            if len(unique) < len(texts):
+                embeddings = embeddings[np.asarray(back, dtype=np.int32)]
+            if not self._is_normalized:
+                print("Warning: adding non-normalized vectors; IP scores won't be cosine")
+            # pick an index by corpus size; embeddings l2-normalized -> cosine.
+            # ids are positional, so plain add() suffices - no IDMap wrapper
+            # paying an extra long[] lookup per scored vector
+            embeddings = embeddings.astype("float32")
+            self.index = self._build_base_index(embeddings)
+            self.index.add(embeddings)
+            self._embeddings = embeddings  # persisted by save_index for reindex()
+            self._apply_search_params()
+            self._maybe_to_gpu()
+            self._build_decorations()
+            self._query_cache.clear()  # results from the old index are stale
             print(f"FAISS index created successfully with {self.index.ntotal} vectors")
             return True
-            
+
         except Exception as e:
             print(f"Error creating FAISS index: {str(e)}")
             return False
-    
+
+    def _build_base_index(self, embeddings: np.ndarray,
+                          kind: Optional[str] = None) -> faiss.Index:
+        """Choose the FAISS index type by corpus size (or INDEX_TYPE
+        override): brute-force scanning is fine for small corpora, HNSW gives
+        log-N traversal for medium ones, IVF-PQ keeps memory and query time
+        sane past ~50k chunks"""
+        n = len(embeddings)
+        kind = kind or config.INDEX_TYPE
+        if kind not in ("flat", "hnsw", "ivfpq"):  # "auto"
+            if n < _HNSW_MIN_DOCS:
+                kind = "flat"
+            elif n < _IVFPQ_MIN_DOCS:
+                kind = "hnsw"
+            else:
+                kind = "ivfpq"
+        self._index_kind = kind
+
+        if kind == "flat":
+            # fp16 codes halve memory bandwidth on the flat scan; FAISS
+            # decodes on the fly so search code is unchanged
+            index = faiss.IndexScalarQuantizer(self.dimension,
+                                               faiss.ScalarQuantizer.QT_fp16,
+                                               faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+            return index
+        if kind == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dimension, config.HNSW_M,
+                                        faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            return index
+        nlist = int(4 * n ** 0.5)
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        m = config.PQ_M or max(1, self.dimension // 8)  # subquantizers, 8-bit codes
+        index = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, m, 8,
+                                 faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        return index
+
+    def _maybe_to_gpu(self):
+        """Clone the index onto the GPU when enabled; order-of-magnitude
+        faster scans on large flat/IVF indexes, no-op otherwise"""
+        if self._gpu_res is None or self.index is None:
+            return
+        try:
+            co = faiss.GpuClonerOptions()
+            co.useFloat16 = True  # halves device memory, ample for cosine
+            self.index = faiss.index_cpu_to_gpu(self._gpu_res, 0, self.index, co)
+            print("FAISS index moved to GPU")
+        except Exception as e:
+            print(f"GPU clone failed, staying on CPU: {e}")
+
+    def _apply_search_params(self):
+        """Set tunable search params on the underlying ANN index (no-op for flat)"""
+        if self.index is None:
+            return
+        base = getattr(self.index, "index", self.index)  # unwrap IDMap (legacy stores)
+        try:
+            base = faiss.downcast_index(base)
+        except Exception:
+            pass
+        if hasattr(base, "hnsw"):
+            base.hnsw.efSearch = config.HNSW_EF_SEARCH
+        if hasattr(base, "nprobe"):
+            base.nprobe = config.IVF_NPROBE
+
+    def reindex(self, index_type: Optional[str] = None,
+                path: str = config.VECTOR_STORE_PATH) -> bool:
+        """Rebuild the FAISS index from the embedding sidecar (or the
+        in-memory matrix), skipping the FastEmbed pass - the expensive step
+        of a normal rebuild - e.g. to switch index types via INDEX_TYPE"""
+        try:
+            emb = self._embeddings
+            if emb is None:
+                emb = np.load(f"{path}.emb.npy").astype(np.float32)
+            else:
+                emb = emb.astype(np.float32, copy=False)
+            if len(emb) != len(self.documents):
+                print("Embedding sidecar does not match documents; full rebuild needed")
+                return False
+            self.index = self._build_base_index(emb, kind=index_type)
+            self.index.add(emb)
+            self._embeddings = emb
+            self._apply_search_params()
+            self._maybe_to_gpu()
+            self._build_decorations()
+            self._query_cache.clear()
+            print(f"Reindexed {self.index.ntotal} vectors as '{self._index_kind}' without re-embedding")
+            return True
+
+        except Exception as e:
+            print(f"Error reindexing: {str(e)}")
+            return False
+
     def save_index(self, path: str = config.VECTOR_STORE_PATH):
         """Save FAISS index and documents to disk"""
         try:
             # create directory if it doesn't exist
             os.makedirs(os.path.dirname(path), exist_ok=True)
-            # save FAISS index
-            faiss.write_index(self.index, f"{path}.index")        
-            # save documents and metadata
+            # save FAISS index (writing needs a CPU index, so clone back down
+            # first when the live one sits on the GPU)
+            index = self.index
+            if self._gpu_res is not None:
+                try:
+                    index = faiss.index_gpu_to_cpu(self.index)
+                except Exception:
+                    pass  # already a CPU index
+            faiss.write_index(index, f"{path}.index")
+            # fp16 embedding sidecar: re-indexing (new index type, retrained
+            # IVF/PQ) can then skip the expensive FastEmbed pass entirely
+            if self._embeddings is not None:
+                np.save(f"{path}.emb.npy", self._embeddings.astype(np.float16))
+            # save documents and metadata; documents go to a parquet sidecar
+            # when pyarrow is around (smaller + much faster than pickle)
+            meta = {
+                'model_name': self.model_name,
+                'dimension': self.dimension,
+                'metric': 'ip',  # inner product over l2-normalized vectors == cosine
+                'index_type': getattr(self, '_index_kind', None),
+                # storage format for downstream tooling: flat stores fp16
+                # codes (IndexScalarQuantizer), ivfpq stores PQ codes
+                'quantizer': {'flat': 'fp16', 'ivfpq': 'pq8'}.get(
+                    getattr(self, '_index_kind', None)),
+            }
+            if _HAS_ARROW and self._save_documents_parquet(f"{path}.docs.parquet"):
+                meta['documents_format'] = 'parquet'
+            else:
+                meta['documents'] = self.documents
             with open(f"{path}.docs", 'wb') as f:
-                pickle.dump({
-                    'documents': self.documents,
-                    'model_name': self.model_name,
-                    'dimension': self.dimension
-                }, f)
+                pickle.dump(meta, f)
             print(f"Vector store saved to {path}")
             return True
             
@@ -134,17 +426,40 @@ class VectorStore:
             if not os.path.exists(f"{path}.index") or not os.path.exists(f"{path}.docs"):
                 print(f"Vector store files not found at {path}")
                 return False
-            # load FAISS index
-            self.index = faiss.read_index(f"{path}.index")
+            # mmap the FAISS index: the OS pages in only touched vectors, and
+            # forked workers share the pages instead of each holding a copy
+            # (create_index still builds the fp32 buffer in RAM, build-time only)
+            if config.MMAP_INDEX:
+                try:
+                    self.index = faiss.read_index(f"{path}.index",
+                                                  faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                except Exception:
+                    # some index types don't support mmap reads, load normally
+                    self.index = faiss.read_index(f"{path}.index")
+            else:
+                self.index = faiss.read_index(f"{path}.index")
             # load documents and metadata
             with open(f"{path}.docs", 'rb') as f:
                 data = pickle.load(f)
-                self.documents = data['documents']
                 saved_model = data.get('model_name', self.model_name)
                 self.dimension = data.get('dimension', self.dimension)
+                self._index_kind = data.get('index_type')
+            if data.get('documents_format') == 'parquet':
+                self.documents = self._load_documents_parquet(f"{path}.docs.parquet")
+            else:
+                self.documents = data['documents']  # legacy pickled stores
             # check model compatibility
             if saved_model != self.model_name:
                 print(f"Warning: Loaded model ({saved_model}) differs from current ({self.model_name})")
+            # older indexes were also IP-over-normalized, so missing key is fine
+            saved_metric = data.get('metric', 'ip')
+            if saved_metric != 'ip':
+                print(f"Warning: Loaded index metric ({saved_metric}) is not inner product; "
+                      "scores may not be cosine similarities")
+            self._apply_search_params()
+            self._maybe_to_gpu()
+            self._build_decorations()
+            self._query_cache.clear()
             print(f"Vector store loaded: {len(self.documents)} documents, {self.index.ntotal} vectors")
             return True
             
@@ -152,76 +467,163 @@ class VectorStore:
             print(f"Error loading vector store: {str(e)}")
             return False
     
-    def similarity_search(self, query: str, k: int = config.MAX_CHUNKS_FOR_CONTEXT) -> List[Tuple[Document, float]]:
-        """Search for similar documents"""
+    def _save_documents_parquet(self, file_path: str) -> bool:
+        """Write documents as a columnar table: one text column plus a struct
+        column that unions whatever metadata keys the chunks carry"""
+        try:
+            table = pa.table({
+                "text": pa.array([d.page_content for d in self.documents],
+                                 type=pa.large_string()),
+                "metadata": pa.array([d.metadata or {} for d in self.documents]),
+            })
+            pq.write_table(table, file_path, compression="zstd")
+            return True
+        except Exception as e:
+            print(f"Parquet save failed, falling back to pickle: {e}")
+            return False
+
+    def _load_documents_parquet(self, file_path: str) -> List[Document]:
+        # materialization is deliberately eager: the BM25 retriever walks
+        # every chunk at engine startup anyway, so a lazy Document view would
+        # only defer the same work by a few milliseconds
+        table = pq.read_table(file_path, memory_map=True)
+        texts = table.column("text").to_pylist()
+        metas = table.column("metadata").to_pylist()
+        # struct columns null-pad missing keys; drop those on the way back
+        return [Document(page_content=t,
+                         metadata={k: v for k, v in m.items() if v is not None})
+                for t, m in zip(texts, metas)]
+
+    def similarity_search(self, query: str, k: int = config.MAX_CHUNKS_FOR_CONTEXT,
+                          query_vec: Optional[np.ndarray] = None,
+                          min_score: float = 0.0) -> List[Tuple[Document, float]]:
+        """Search for similar documents; pass query_vec to reuse an embedding
+        the caller already computed (e.g. for a cache probe), min_score to
+        drop weak hits with a vectorized mask instead of a caller-side loop"""
         if not self.index or not self.documents:
             print("Vector store not initialized")
             return []
+        # repeat queries skip both the model and the FAISS scan; results are
+        # deterministic for a given index, cleared whenever the index changes
+        key = (query, k, min_score)
+        hit = self._query_cache.get(key)
+        if hit is not None:
+            self._query_cache.move_to_end(key)
+            return hit
         try:
-            # create query embedding
-            query_embedding = self.create_embeddings([query])
-            # search FAISS index
-            scores, indices = self.index.search(query_embedding.astype("float32"), k)
-            # return documents with similarity scores
-            results: List[Tuple[Document, float]] = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx == -1:
-                    continue
-                if idx < len(self.documents):
-                    # score is cosine similarity in [-1, 1]
-                    results.append((self.documents[int(idx)], float(score)))
+            # create query embedding unless the caller supplied one
+            if query_vec is not None:
+                query_embedding = np.asarray(query_vec, dtype="float32")
+                if query_embedding.ndim == 1:
+                    query_embedding = query_embedding.reshape(1, -1)
+            else:
+                query_embedding = self._embed_query(query)
+            # search FAISS index (both paths already produce float32)
+            scores, indices = self.index.search(query_embedding, k)
+            # one vectorized mask instead of branching per hit; scores are
+            # cosine similarity in [-1, 1]
+            mask = (indices[0] != -1) & (indices[0] < len(self.documents)) \
+                   & (scores[0] >= min_score)
+            results: List[Tuple[Document, float]] = [
+                (self.documents[int(i)], float(s))
+                for i, s in zip(indices[0][mask], scores[0][mask])]
+            self._query_cache[key] = results
+            while len(self._query_cache) > _QUERY_CACHE_MAX:
+                self._query_cache.popitem(last=False)
             return results
-            
+
         except Exception as e:
             print(f"Error in similarity search: {str(e)}")
             return []
-    
+
+    def similarity_search_batch(self, queries: List[str], k: int = config.MAX_CHUNKS_FOR_CONTEXT,
+                                min_score: float = 0.0) -> List[List[Tuple[Document, float]]]:
+        """Search several queries with one embed call and one FAISS search"""
+        if not self.index or not self.documents:
+            print("Vector store not initialized")
+            return [[] for _ in queries]
+        try:
+            query_embeddings = self.create_embeddings(list(queries))
+            scores, indices = self.index.search(query_embeddings.astype("float32"), k)
+            batched: List[List[Tuple[Document, float]]] = []
+            for row_scores, row_indices in zip(scores, indices):
+                mask = (row_indices != -1) & (row_indices < len(self.documents)) \
+                       & (row_scores >= min_score)
+                batched.append([(self.documents[int(i)], float(s))
+                                for i, s in zip(row_indices[mask], row_scores[mask])])
+            return batched
+
+        except Exception as e:
+            print(f"Error in batch similarity search: {str(e)}")
+            return [[] for _ in queries]
+
     # Convenience for RAG prompt building & citations
-    def topk_with_citations(self, query: str, k: int = config.MAX_CHUNKS_FOR_CONTEXT) -> List[Dict]:
+    def topk_with_citations(self, query: str, k: int = config.MAX_CHUNKS_FOR_CONTEXT,
+                            query_vec: Optional[np.ndarray] = None,
+                            min_score: float = 0.0) -> List[Dict]:
         """Return top-k hits with compact citation strings for Markdown sections"""
-        hits = self.similarity_search(query, k=k)
+        return self._decorate_hits(self.similarity_search(
+            query, k=k, query_vec=query_vec, min_score=min_score))
+
+    def topk_with_citations_batch(self, queries: List[str], k: int = config.MAX_CHUNKS_FOR_CONTEXT,
+                                  min_score: float = 0.0) -> List[List[Dict]]:
+        """Batched topk_with_citations: one embed + one FAISS search for all queries"""
+        return [self._decorate_hits(hits)
+                for hits in self.similarity_search_batch(queries, k=k, min_score=min_score)]
+
+    def _build_decorations(self):
+        """Precompute citation fields per document: they are pure functions
+        of metadata, so deriving them per hit per query was wasted work"""
+        self._decorations = {id(doc): self._decorate_doc(doc, i)
+                             for i, doc in enumerate(self.documents)}
+
+    @staticmethod
+    def _decorate_doc(doc: Document, position: int) -> Dict:
+        meta = doc.metadata or {}
+        src_name = Path(meta.get("source", "Unknown")).name  # filename
+        sec_path = meta.get("section_path") or meta.get("section") or ""
+        chunk_idx = meta.get("chunk_index",
+                    meta.get("chunk_in_section", position))  # consistent key
+        return {
+            "source": src_name,
+            "section_path": sec_path,
+            "chunk_index": chunk_idx,
+            "citation": f"{src_name}" + (f" §{sec_path}" if sec_path else ""),
+            "uid": (src_name, sec_path, chunk_idx),          # aligns with BM25
+        }
+
+    def _decorate_hits(self, hits: List[Tuple[Document, float]]) -> List[Dict]:
         out = []
         for rank, (doc, score) in enumerate(hits, start=1):
-            meta = doc.metadata or {}
-            src_name = Path(meta.get("source", "Unknown")).name  # filename
-            sec_path = meta.get("section_path") or meta.get("section") or ""
-            chunk_idx = meta.get("chunk_index",
-                        meta.get("chunk_in_section", rank - 1))  # consistent key
-
-            citation = f"{src_name}" + (f" §{sec_path}" if sec_path else "")
-            uid = (src_name, sec_path, chunk_idx)                # ligns with BM25
-
-            out.append({
-                "doc": doc,
-                "score": float(score),
-                "rank": rank,
-                "source": src_name,
-                "section_path": sec_path,
-                "chunk_index": chunk_idx,
-                "citation": citation,
-                "uid": uid,
-            })
+            deco = self._decorations.get(id(doc))
+            if deco is None:  # doc not from this index, derive on the spot
+                deco = self._decorate_doc(doc, rank - 1)
+            out.append({"doc": doc, "score": float(score), "rank": rank, **deco})
         return out
 
     def build_context(self, hits: List[Dict], max_chars: int = config.MAX_CONTEXT_LENGTH) -> str:
+        # budget in tokens when tiktoken is around (what prefill actually
+        # costs), in chars otherwise; token counts are cached per chunk text
+        budget = config.MAX_CONTEXT_TOKENS if _TOKEN_ENC is not None else max_chars
         seen = set()
         parts, total = [], 0
         for h in hits:
-            doc: Document = h["doc"]
-            meta = doc.metadata or {}
-            src = Path(meta.get("source", "Unknown")).name
-            sec = meta.get("section_path") or meta.get("section") or ""
-            key = (src, sec)
+            # hits arrive decorated (topk_with_citations / rrf_fuse), so the
+            # citation fields are already computed - no metadata lookups here
+            key = (h["source"], h["section_path"])
             if key in seen:  # skip duplicate sections
                 continue
             seen.add(key)
 
-            cite: str = f"{src}" + (f" §{sec}" if sec else "")
-            frag = f"[source: {cite}]\n{doc.page_content}\n"
-            if total + len(frag) > max_chars:
+            remaining = budget - total
+            if remaining <= 0:
+                break
+            frag = f"[source: {h['citation']}]\n{h['doc'].page_content}\n"
+            cost = _token_len(frag) if _TOKEN_ENC is not None else len(frag)
+            if cost > remaining:
                 break
             parts.append(frag)
-            total += len(frag)
+            total += cost
             if len(seen) >= config.MAX_DISTINCT_CITATIONS:
                 break
         return "\n".join(parts).strip()
@@ -1,11 +1,13 @@
 # app/streamlit_app.py
 import os
 import re
-import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import streamlit as st
 
 import config
+from rag_chatbot.hashing import new_content_hasher, hex12, hash12
 from rag_chatbot.indexing.document_processor import DocumentProcessor
 from rag_chatbot.stores.vector_store import VectorStore, build_vector_store
 from rag_chatbot.llm.llm_handler import ChatLLM
@@ -19,11 +21,39 @@ st.set_page_config(page_title=config.PAGE_TITLE, page_icon=config.PAGE_ICON, lay
 
 CITE_RE = re.compile(r"\[source:\s*[^\]]+\]")
 
+# one alternation, one pass: citation (with any leading spaces), run of
+# spaces/tabs, run of 3+ newlines - replaces three sequential sub() passes
+_CLEAN_RE = re.compile(r"[ \t]*\[source:\s*[^\]]+\]|[ \t]{2,}|\n{3,}")
+
+def _clean_repl(m: "re.Match") -> str:
+    t = m.group()
+    if "[source:" in t:
+        return ""
+    return "\n\n" if t.startswith("\n") else " "
+
 def strip_citations(text: str) -> str:
-    cleaned = CITE_RE.sub("", text)
-    cleaned = re.sub(r"[ \t]{2,}", " ", cleaned)
-    cleaned = re.sub(r"\n{3,}", "\n\n", cleaned)
-    return cleaned.strip()
+    return _CLEAN_RE.sub(_clean_repl, text).strip()
+
+def cleaned_stream(tokens):
+    """Wrap a token stream, yielding citation-free deltas: each chunk is
+    cleaned once as it arrives instead of re-cleaning the whole buffer per
+    token, holding back an unfinished [ tail until it closes"""
+    pending = ""
+    for tok in tokens:
+        pending += tok
+        cut = pending.rfind("[")
+        if cut != -1 and "]" not in pending[cut:]:
+            safe, pending = pending[:cut], pending[cut:]
+        else:
+            safe, pending = pending, ""
+        if safe:
+            out = _CLEAN_RE.sub(_clean_repl, safe)
+            if out:
+                yield out
+    if pending:
+        out = _CLEAN_RE.sub(_clean_repl, pending)
+        if out:
+            yield out
 
 def _has_any_docs() -> bool:
     data_dir = Path(config.DATA_DIR)
@@ -39,15 +69,71 @@ def _has_index() -> bool:
 def _safe_name(name: str) -> str:
     return name.replace("\\", "_").replace("/", "_").strip()
 
-def _dedup_save(upload, folder: Path) -> str:
-    raw = upload.read()
-    digest = hashlib.sha256(raw).hexdigest()[:12]
+_UPLOAD_CHUNK = 1 << 16  # 64 KB: hash and write per chunk, not per file
+_PRECHECK_BYTES = 8192   # (size, first-8KB hash) fingerprint for the dedup pre-check
+
+def _fingerprint_map(folder: Path) -> dict:
+    # (size, first-8KB sha256 prefix) -> filename for every file already in
+    # the folder; cached in session_state so re-uploads in later reruns get
+    # pre-checked without re-scanning the folder
+    cache = st.session_state.setdefault("upload_fingerprints", {})
+    key = str(folder)
+    if key not in cache:
+        fp = {}
+        try:
+            for p in folder.iterdir():
+                if p.name.startswith(".") or not p.is_file():
+                    continue
+                with open(p, "rb") as f:
+                    head = f.read(_PRECHECK_BYTES)
+                fp[(p.stat().st_size, hash12(head))] = p.name
+        except OSError:
+            pass
+        cache[key] = fp
+    return cache[key]
+
+def _dedup_save(upload, folder: Path, fingerprints=None) -> str:
+    # stream into a temp file while hashing, then rename into place; peak
+    # memory is one chunk instead of the whole upload, and a half-written
+    # file can never be picked up by the indexer
     safe = _safe_name(upload.name)
-    target = folder / f"{digest}_{safe}"
-    if not target.exists():
-        target.write_bytes(raw)
+    # cheap pre-check: only a probable re-upload (matching size + first 8 KB)
+    # pays for a confirming full hash, and a confirmed duplicate never
+    # touches the disk at all
+    head = upload.read(_PRECHECK_BYTES)
+    pre_key = (upload.size, hash12(head))
+    if fingerprints is not None and pre_key in fingerprints:
+        confirm = new_content_hasher()
+        confirm.update(head)
+        while chunk := upload.read(_UPLOAD_CHUNK):
+            confirm.update(chunk)
+        if (folder / f"{hex12(confirm)}_{safe}").exists():
+            return f"Duplicate skipped: {upload.name}"
+        # prefix collision with a different file: fall through and save
+    upload.seek(0)
+    hasher = new_content_hasher()
+    tmp = tempfile.NamedTemporaryFile(dir=folder, prefix=".upload-", delete=False)
+    try:
+        while chunk := upload.read(_UPLOAD_CHUNK):
+            hasher.update(chunk)
+            tmp.write(chunk)
+        tmp.close()
+        digest = hex12(hasher)
+        target = folder / f"{digest}_{safe}"
+        if target.exists():
+            os.unlink(tmp.name)
+            return f"Duplicate skipped: {upload.name}"
+        os.replace(tmp.name, target)
+        if fingerprints is not None:
+            fingerprints[pre_key] = target.name
         return f"Saved: {upload.name}"
-    return f"Duplicate skipped: {upload.name}"
+    except Exception:
+        tmp.close()
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+        raise
 
 # ---------------------------
 # Cached resources
@@ -127,9 +213,10 @@ with st.sidebar:
     if uploads:
         data_dir = Path(config.DATA_DIR)
         data_dir.mkdir(parents=True, exist_ok=True)
-        msgs = []
-        for f in uploads:
-            msgs.append(_dedup_save(f, data_dir))
+        # save files in parallel so disk latency overlaps across the batch
+        fingerprints = _fingerprint_map(data_dir)
+        with ThreadPoolExecutor(max_workers=4) as ex:
+            msgs = list(ex.map(lambda f: _dedup_save(f, data_dir, fingerprints), uploads))
         for m in msgs:
             st.write("• " + m)
         st.warning("Uploaded. Click **Rebuild index** below.")
@@ -210,14 +297,10 @@ if user_q:
                     # Stream raw tokens (with citations)
                     final_text = st.write_stream(engine.answer_stream(user_q))
                 else:
-                    # Live stream but render a citation-free view
-                    placeholder = st.empty()
-                    buf = []
-                    for token in engine.answer_stream(user_q):
-                        buf.append(token)
-                        cleaned = strip_citations("".join(buf))
-                        placeholder.markdown(cleaned)
-                    final_text = strip_citations("".join(buf))
+                    # Live stream a citation-free view; cleaning happens per
+                    # delta, not over the whole buffer per token
+                    final_text = st.write_stream(cleaned_stream(engine.answer_stream(user_q)))
+                    final_text = final_text.strip()
             except Exception as e:
                 st.error("The answer engine had an issue.")
                 st.code(f"{e}")